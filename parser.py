@@ -2,13 +2,14 @@
 """
 Parse HTML entities table from an HTML file.
 Looks for the first table in a div with id="named-character-references-table".
+Also accepts a JSON file previously generated with `--format json --prefix ''`,
+which skips HTML parsing entirely.
 Outputs JSON to stdout or a specified file.
 """
 
 import re
 import html
 import sys
-import os
 import json
 import argparse
 import logging
@@ -21,48 +22,81 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Opening tag of div with id="named-character-references-table".
+# We only match the tag itself; the table is located with the simple tag patterns
+# below, so the regex engine never captures and re-scans the whole div body.
+# The tag runs exclude `<` as well as `>`, so each attempt stops at the next tag
+# and an unterminated `<div` can't make the search rescan the rest of the file.
+_DIV_RE = re.compile(
+    rb'<div[^<>]*\sid=["\']?named-character-references-table["\']?[^<>]*>',
+    re.IGNORECASE,
+)
+_DIV_END_RE = re.compile(rb"</div\s*>", re.IGNORECASE)
+_TABLE_START_RE = re.compile(rb"<table\b", re.IGNORECASE)
+_TABLE_END_RE = re.compile(rb"</table\s*>", re.IGNORECASE)
+
+# Pattern to match table rows with entity information
+# <td> <code>entity_name</code> <td> unicode <td> <span ...>glyph</span>
+# Attributes on any of the tags and optional closing </td> tags are allowed,
+# so the pattern doesn't depend on the exact markup WHATWG happens to emit.
+# Every repeated character class is followed by a character it cannot match
+# (`\s*` and `[^<]+` by `<`, `[^>]*` by `>`), so each run is effectively atomic
+# and the engine never backtracks into it, even on malformed rows.
+_ROW_RE = re.compile(
+    rb"<td[^>]*>\s*<code[^>]*>([^<]+)</code>\s*(?:</td>\s*)?"
+    rb"<td[^>]*>[^<]+(?:</td>\s*)?"
+    rb"<td[^>]*>\s*<span[^>]*>([^<]+)</span>",
+    re.IGNORECASE,
+)
+
 
 def find_table_in_div(html_content):
     """
     Find the first table within div#named-character-references-table.
-    Returns the table HTML or None if not found.
+    Takes the raw bytes of the HTML document.
+    Returns the (start, end) offsets of the table HTML or None if not found.
     """
-    # Pattern to find div with id="named-character-references-table"
-    # and extract its content including nested tags
-    div_pattern = (
-        r'<div[^>]*\sid=["\']?named-character-references-table["\']?[^>]*>(.*?)</div>'
-    )
-    div_match = re.search(div_pattern, html_content, re.DOTALL | re.IGNORECASE)
+    div_match = _DIV_RE.search(html_content)
 
     if not div_match:
         logger.error("Could not find div with id='named-character-references-table'.")
         return None
 
-    div_content = div_match.group(1)
-    table_pattern = r"<table[^>]*>.*?</table>"
-    table_match = re.search(table_pattern, div_content, re.DOTALL | re.IGNORECASE)
-    if not table_match:
+    # Bound the search to the div's content, like the old lazy `(.*?)</div>` did,
+    # but with linear scans that can't backtrack on malformed input.
+    # As before, a div without a closing tag doesn't count as found.
+    div_end_match = _DIV_END_RE.search(html_content, div_match.end())
+    if not div_end_match:
+        logger.error("Could not find div with id='named-character-references-table'.")
+        return None
+    div_end = div_end_match.start()
+
+    table_start_match = _TABLE_START_RE.search(html_content, div_match.end(), div_end)
+    if not table_start_match:
         logger.error("Could not find any table in the specified div.")
         return None
-    return table_match.group(0)
+    table_end_match = _TABLE_END_RE.search(html_content, table_start_match.end(), div_end)
+    if not table_end_match:
+        logger.error("Could not find the end of the table in the specified div.")
+        return None
+    return table_start_match.start(), table_end_match.end()
 
 
-def parse_html_entities_table(table_html):
+def parse_html_entities_table(html_content, start, end, prefix=""):
     """
     Parse HTML table containing entity definitions.
-    Returns a dictionary mapping entity names to their Unicode glyphs.
+    Takes the raw bytes of the HTML document and the table's offsets within it,
+    as returned by find_table_in_div, so the table is never copied out of the document;
+    only the matched entity names and glyphs are decoded.
+    Returns a dictionary mapping prefixed entity names to their Unicode glyphs.
     """
     entities = {}
 
-    # Pattern to match table rows with entity information
-    # <td> <code>entity_name</code> <td> unicode <td> <span ...>glyph</span>
-    pattern = (
-        r"<td>\s*<code>([^<]+)</code>\s*<td>\s*[^<]+\s*<td>\s*<span[^>]*>([^<]+)</span>"
-    )
-
-    matches = re.findall(pattern, table_html)
+    # finditer yields one match at a time instead of building a list of every row
+    for match in _ROW_RE.finditer(html_content, start, end):
+        entity_name = match.group(1).decode("utf-8")
+        glyph = match.group(2).decode("utf-8")
 
-    for entity_name, glyph in matches:
         # Clean up entity name (remove semicolon if present)
         entity_name = entity_name.strip()
 
@@ -75,20 +109,35 @@ def parse_html_entities_table(table_html):
         # Unescape HTML entities in the glyph (e.g., &amp; -> &)
         # Most entities in the table have their actual glyphs,
         # but those that would mess up HTML parsing like &<" etc are escaped.
-        glyph = html.unescape(glyph)
+        # Only those contain an ampersand, so skip the unescape call otherwise.
+        if "&" in glyph:
+            glyph = html.unescape(glyph)
 
         # Store in dictionary
-        entities[entity_name] = glyph
+        entities[f"{prefix}{entity_name}"] = glyph
 
     return entities
 
 
-def entities_dict_to_espanso_package_dict(entities):
+def load_entities_json(json_content, prefix=""):
     """
-    Convert entities dictionary to espanso package.yml contents,
-    which contains a list of dictionaries with 'trigger' and 'replace' keys.
+    Load a JSON object mapping unprefixed entity names to glyphs,
+    as written by `--format json --prefix ''`.
+    Returns a dictionary mapping prefixed entity names to their Unicode glyphs.
+    Raises ValueError if the content is not valid JSON or not an object of strings.
     """
-    return {k: v for k, v in entities.items()}
+    entities = json.loads(json_content)
+    if not isinstance(entities, dict):
+        raise ValueError("expected a JSON object mapping entity names to glyphs")
+    for k, v in entities.items():
+        if not isinstance(v, str):
+            raise ValueError(f"expected a string glyph for entity '{k}'")
+    return {f"{prefix}{k}": v for k, v in entities.items()}
+
+
+# Control characters (Cc), Format characters (Cf), Surrogates (Cs),
+# Private use (Co), and Unassigned (Cn) are considered non-printable
+_NONPRINTABLE_CATEGORIES = frozenset(("Cc", "Cf", "Cs", "Co", "Cn"))
 
 
 def is_printable(char):
@@ -97,10 +146,7 @@ def is_printable(char):
     Returns True if the character is considered printable, False otherwise.
     """
     # Check if character is in a printable category
-    category = unicodedata.category(char)
-    # Control characters (Cc), Format characters (Cf), Surrogates (Cs), 
-    # Private use (Co), and Unassigned (Cn) are considered non-printable
-    if category in ['Cc', 'Cf', 'Cs', 'Co', 'Cn']:
+    if unicodedata.category(char) in _NONPRINTABLE_CATEGORIES:
         return False
     # Also check for specific non-printable characters
     if ord(char) < 32 and char not in '\t\n\r':
@@ -113,45 +159,68 @@ def filter_entities_by_class(entities, filter_class):
     Filter entities based on the specified class.
     Returns a dictionary containing only entities matching the filter criteria.
     """
-    if filter_class == "printable":
-        return {k: v for k, v in entities.items() if all(is_printable(c) for c in v)}
-    elif filter_class == "unprintable":
-        return {k: v for k, v in entities.items() if any(not is_printable(c) for c in v)}
-    else:
+    if filter_class not in ("printable", "unprintable"):
         # No filter or unknown filter - return all entities
         return entities
 
+    # Check each distinct character once, then test every entity against that set
+    distinct_chars = set().union(*entities.values())
+    unprintable_chars = frozenset(c for c in distinct_chars if not is_printable(c))
+
+    if filter_class == "printable":
+        return {k: v for k, v in entities.items() if unprintable_chars.isdisjoint(v)}
+    else:
+        return {k: v for k, v in entities.items() if not unprintable_chars.isdisjoint(v)}
+
 
-def prefix_dict_keys(d, prefix):
+def write_json(d, fp):
     """
-    Prefix all keys in the dictionary with the given prefix.
-    Returns a new dictionary with prefixed keys.
+    Write the dictionary as JSON to the given writable file object.
     """
-    return {f"{prefix}{k}": v for k, v in d.items()}
+    json.dump(d, fp, indent=2, ensure_ascii=False)
+    fp.write("\n")
+
+
+# Characters that json.dumps(..., ensure_ascii=False) escapes in a string.
+# Values without any of them are quoted identically by just wrapping them in "".
+_NEEDS_ESCAPE_RE = re.compile(r'[\\"\x00-\x1f]')
 
 
-def get_espanso_package_yml(d):
+def write_espanso_package_yml(d, fp):
     """
-    Write the espanso package.yml contents to the specified output file.
+    Write the espanso package.yml contents to the given writable file object.
+    Each match is written as it is produced, so the whole file is never held in memory.
 
     json.dumps handles escaping for us, including:
     - Backslashes
     - Single and double quote characters
     - Special characters that contain things that need escaping, like `>⃒`
+    Most glyphs need no escaping at all, so json.dumps is only called for those that do.
     """
-    output = ["matches:"]
+    fp.write("matches:\n")
     for k, v in d.items():
-        output.append(f"- trigger: {k}")
-        quoted_v = json.dumps(v, ensure_ascii=False)
-        output.append(f"  replace: {quoted_v}")
-    return "\n".join(output)
+        if _NEEDS_ESCAPE_RE.search(v) is None:
+            quoted_v = f'"{v}"'
+        else:
+            quoted_v = json.dumps(v, ensure_ascii=False)
+        fp.write(f"- trigger: {k}\n  replace: {quoted_v}\n")
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Parse HTML entities table from an HTML file and output JSON."
+        description="Parse HTML entities table from an HTML file, or load pre-parsed entities from a JSON file, and output JSON or an espanso package."
+    )
+    parser.add_argument(
+        "input_file",
+        help="HTML file containing the entities table, or a JSON file of pre-parsed entities",
+    )
+    parser.add_argument(
+        "-t",
+        "--input-format",
+        choices=["html", "json"],
+        default=None,
+        help="Input format. 'html' is the WHATWG named characters page, while 'json' is the output of '--format json'. (Default: 'json' if the input file name ends in .json, otherwise 'html')",
     )
-    parser.add_argument("input_file", help="HTML file containing the entities table")
     parser.add_argument(
         "-o", "--output", help="Output file (default: stdout)", default=None
     )
@@ -177,41 +246,57 @@ def main():
     )
     args = parser.parse_args()
 
-    if not os.path.exists(args.input_file):
+    try:
+        with open(args.input_file, "rb") as f:
+            input_content = f.read()
+    except FileNotFoundError:
         logger.error(f"File '{args.input_file}' not found.")
         sys.exit(1)
-
-    try:
-        with open(args.input_file, "r", encoding="utf-8") as f:
-            html_content = f.read()
-    except Exception as e:
+    except OSError as e:
         logger.error(f"Error reading file: {e}")
         sys.exit(1)
 
-    table_html = find_table_in_div(html_content)
-    if not table_html:
-        logger.error("Could not find any table in the HTML file.")
-        sys.exit(1)
+    input_format = args.input_format
+    if input_format is None:
+        input_format = "json" if args.input_file.lower().endswith(".json") else "html"
 
-    entities = parse_html_entities_table(table_html)
-    if not entities:
-        logger.error("No entities found in the table.")
-        sys.exit(1)
+    if input_format == "json":
+        try:
+            entities = load_entities_json(input_content, prefix=args.prefix)
+        except ValueError as e:
+            logger.error(f"Error parsing JSON file: {e}")
+            sys.exit(1)
+        if not entities:
+            logger.error("No entities found in the JSON file.")
+            sys.exit(1)
+        else:
+            logger.info(f"Loaded {len(entities)} HTML entities from {args.input_file}")
     else:
-        logger.info(f"Parsed {len(entities)} HTML entities from {args.input_file}")
+        table_span = find_table_in_div(input_content)
+        if not table_span:
+            logger.error("Could not find any table in the HTML file.")
+            sys.exit(1)
+
+        try:
+            entities = parse_html_entities_table(input_content, *table_span, prefix=args.prefix)
+        except UnicodeDecodeError as e:
+            logger.error(f"Error decoding file: {e}")
+            sys.exit(1)
+        if not entities:
+            logger.error("No entities found in the table.")
+            sys.exit(1)
+        else:
+            logger.info(f"Parsed {len(entities)} HTML entities from {args.input_file}")
 
     # Apply filter if specified
     if args.filter:
         entities = filter_entities_by_class(entities, args.filter)
         logger.info(f"After filtering for {args.filter} characters: {len(entities)} entities")
 
-    prefixed = prefix_dict_keys(entities, args.prefix)
-
-    formatted = ""
     if args.format == "json":
-        formatted = json.dumps(prefixed, indent=2, ensure_ascii=False)
+        write_output = write_json
     elif args.format == "espanso":
-        formatted = get_espanso_package_yml(prefixed)
+        write_output = write_espanso_package_yml
     else:
         logger.error(f"Unsupported format: {args.format}")
         sys.exit(1)
@@ -219,14 +304,14 @@ def main():
     if args.output:
         try:
             with open(args.output, "w", encoding="utf-8") as f:
-                f.write(formatted)
+                write_output(entities, f)
             logger.info(f"Output written to '{args.output}'")
         except Exception as e:
             logger.error(f"Error writing output file: {e}")
             sys.exit(1)
     else:
         # Write to stdout
-        print(formatted)
+        write_output(entities, sys.stdout)
 
 
 if __name__ == "__main__":